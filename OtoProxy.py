@@ -1,44 +1,66 @@
 import asyncio
 import aiohttp
-import platform
+import errno
 import os
 import socket
 import re
 import time
 import logging
 from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlsplit
+from aiohttp_socks import ProxyConnector
 from diskcache import Cache
-from typing import List, Set, Tuple # Explicitly include Tuple
+from typing import FrozenSet, List, Optional, Set, Tuple # Explicitly include Tuple
 
 # Konfigurasi logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Konfigurasi UVLoop untuk Linux
-if platform.system() == 'Linux':
-    try:
-        import uvloop
-        uvloop.install()
-        logger.info("UVLoop activated for enhanced performance")
-    except ImportError:
-        logger.warning("UVLoop not available, using standard event loop")
+# Konfigurasi UVLoop (Linux, macOS, BSD); fallback ke asyncio standar
+try:
+    import uvloop
+    run = uvloop.run
+    logger.info("UVLoop activated for enhanced performance")
+except ImportError:
+    run = asyncio.run
+    logger.warning("UVLoop not available, using standard event loop")
+
+# Endpoint pengecekan konektivitas (HTTP 204, tanpa body)
+CHECK_URL = "http://connectivitycheck.gstatic.com/generate_204"
+
+# Batas body per sumber dan timeout fetch agar sumber rusak/lambat tidak menahan worker
+MAX_SOURCE_BYTES = 4 * 1024 * 1024
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_read=5)
+
+# Resolver DNS publik untuk aiodns
+DNS_NAMESERVERS = ['1.1.1.1', '8.8.8.8']
+DNS_CACHE_TTL = 3600
 
 # Konfigurasi direktori cache
 CACHE_DIR = './cache'
 if not os.path.exists(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
-# Konfigurasi cache
-cache = Cache(CACHE_DIR, size_limit=int(1e9), ttl=1800)
+@lru_cache(maxsize=4)
+def _read_entries(path: str, mtime: float) -> FrozenSet[str]:
+    # split() tanpa argumen sudah strip dan buang baris kosong; frozenset sekaligus dedup
+    with open(path, 'r') as f:
+        return frozenset(f.read().split())
+
+def read_entries(path: str) -> FrozenSet[str]:
+    # Di-cache per mtime: dibaca ulang hanya jika file berubah
+    return _read_entries(path, os.path.getmtime(path))
 
 class Proxy:
-    __slots__ = ('ip', 'port', 'protocol', 'latency')
+    __slots__ = ('ip', 'port', 'protocol', 'latency', 'url')
 
     def __init__(self, ip: str, port: int, protocol: str, latency: float = 0):
         self.ip = ip
         self.port = port
         self.protocol = protocol
         self.latency = latency
+        self.url = f"{protocol}://{ip}:{port}"
 
     def format(self) -> str:
         return f"{self.ip}:{self.port}"
@@ -51,17 +73,75 @@ class Proxy:
     def __hash__(self):
         return hash((self.ip, self.port))
 
+class AdaptiveLimiter:
+    # Batas konkurensi AIMD ala kontrol kongesti TCP: naik +increase per jendela
+    # yang tenang, turun setengah saat timeout/kehabisan fd melonjak di atas baseline
+    def __init__(self, initial: int, minimum: int, maximum: int, window: int = 200,
+                 increase: int = 10, spike: float = 0.2):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.increase = increase
+        self.spike = spike
+        self.active = 0
+        self.samples = 0
+        self.congested = 0
+        self.baseline = None
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self.condition:
+            self.active -= 1
+            # Bangunkan hanya sebanyak slot kosong, bukan seluruh antrean
+            self.condition.notify(max(self.limit - self.active, 0))
+
+    def record(self, congested: bool):
+        self.samples += 1
+        self.congested += congested
+        if self.samples < self.window:
+            return
+        rate = self.congested / self.samples
+        if self.baseline is not None and rate > self.baseline + self.spike:
+            if self.limit > self.minimum:
+                self.limit = max(self.minimum, self.limit // 2)
+                logger.info(f"Concurrency decreased to {self.limit} (timeout rate {rate:.0%})")
+        elif self.baseline is None or rate <= self.baseline:
+            self.limit = min(self.maximum, self.limit + self.increase)
+        self.baseline = rate if self.baseline is None else 0.8 * self.baseline + 0.2 * rate
+        self.samples = 0
+        self.congested = 0
+
 class ProxyScraper:
+    # Satu scan regex di C atas body mentah menggantikan parsing per baris.
+    # Lookaround mencegah match parsial seperti "99.1.1.1" dari "999.1.1.1" dan
+    # menolak alamat yang tidak bisa dirutekan (0/8, 127/8, 255/8, 169.254/16)
+    _PROXY_RE = re.compile(
+        rb'(?<![0-9.])(?!0{1,3}\.|127\.|255\.|169\.254\.)((?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)):([0-9]{1,5})(?![0-9])'
+    )
+
+    _TOKEN_BYTES = b'0123456789.:'
+
     def __init__(self):
         self.sources = self.load_sources()
         self.session = None
+        self.fetch_session = None
+        self.socks_check_url = CHECK_URL
+        self.socks_check_headers = None
         self.max_connections = 1000
-        self.semaphore = asyncio.Semaphore(self.max_connections)
-        self.ip_pattern = re.compile(r'^(?:(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.){3}(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)$')
-        self.seen_proxies = set()
+        # Fetch sumber punya batas sendiri, terpisah dari slot cek proxy
+        self.fetch_semaphore = asyncio.Semaphore(64)
+        self.seen_proxies: Set[Tuple[str, int]] = set()
         self.cache = Cache(CACHE_DIR, size_limit=int(1e9), ttl=1800)
         self.latency_limit = 1500
-        self.batch_size = 2000  # Disesuaikan untuk 90% penggunaan CPU/RAM
+        self.min_concurrency = 50
+        self.queue_size = 10000
         self.blacklist = self.load_blacklist()
 
     async def __aenter__(self):
@@ -72,21 +152,11 @@ class ProxyScraper:
         await self.close_session()
         self.cache.close()
 
-    def is_valid_ip(self, ip: str) -> bool:
-        return bool(self.ip_pattern.match(ip))
-
-    def is_valid_port(self, port: int) -> bool:
-        return 0 < port < 65536
-
-    def load_blacklist(self) -> Set[str]:
-        blacklist = set()
+    def load_blacklist(self) -> FrozenSet[str]:
+        blacklist = frozenset()
         try:
             if os.path.exists('blacklist.txt'):
-                with open('blacklist.txt', 'r') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            blacklist.add(line)
+                blacklist = read_entries('blacklist.txt')
             logger.info(f"Loaded {len(blacklist)} blacklisted proxies")
         except Exception as e:
             logger.error(f"Error loading blacklist: {e}")
@@ -95,17 +165,15 @@ class ProxyScraper:
     def load_sources(self) -> dict:
         sources = {'http': [], 'socks4': [], 'socks5': []}
         try:
-            with open('sites.txt', 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or not line.startswith('http'):
-                        continue
-                    if 'socks4' in line.lower():
-                        sources['socks4'].append(line)
-                    elif 'socks5' in line.lower():
-                        sources['socks5'].append(line)
-                    else:
-                        sources['http'].append(line)
+            for line in read_entries('sites.txt'):
+                if not line.startswith('http'):
+                    continue
+                if 'socks4' in line.lower():
+                    sources['socks4'].append(line)
+                elif 'socks5' in line.lower():
+                    sources['socks5'].append(line)
+                else:
+                    sources['http'].append(line)
             logger.info(f"Loaded sources: HTTP={len(sources['http'])}, SOCKS4={len(sources['socks4'])}, SOCKS5={len(sources['socks5'])}")
         except FileNotFoundError:
             logger.error("sites.txt not found, using default sources")
@@ -116,11 +184,38 @@ class ProxyScraper:
             }
         return sources
 
+    @staticmethod
+    def make_resolver():
+        try:
+            # c-ares via aiodns (aiohttp[speedups]) alih-alih getaddrinfo di thread pool
+            return aiohttp.AsyncResolver(nameservers=DNS_NAMESERVERS)
+        except RuntimeError:
+            return None
+
+    async def resolve_check_url(self):
+        # Host CHECK_URL di-resolve sekali per run. ProxyConnector mengabaikan resolver
+        # dan SOCKS4 tanpa rdns me-resolve lokal, jadi probe SOCKS memakai URL ber-IP
+        # dengan header Host asli agar tidak ada getaddrinfo per kandidat
+        parts = urlsplit(CHECK_URL)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                parts.hostname, parts.port or 80, family=socket.AF_INET, type=socket.SOCK_STREAM
+            )
+        except OSError as e:
+            logger.warning(f"Could not resolve {parts.hostname}, SOCKS checks will resolve per proxy: {e}")
+            return
+        ip = infos[0][4][0]
+        self.socks_check_url = parts._replace(netloc=ip if parts.port is None else f"{ip}:{parts.port}").geturl()
+        self.socks_check_headers = {'Host': parts.netloc}
+
     async def init_session(self):
+        if self.socks_check_headers is None:
+            await self.resolve_check_url()
         if not self.session:
             connector = aiohttp.TCPConnector(
+                resolver=self.make_resolver(),
                 limit=self.max_connections,
-                ttl_dns_cache=300,
+                ttl_dns_cache=DNS_CACHE_TTL,
                 force_close=True,
                 enable_cleanup_closed=True,
                 use_dns_cache=True,
@@ -137,9 +232,56 @@ class ProxyScraper:
                     'Connection': 'close'
                 }
             )
+        if not self.fetch_session:
+            # Sesi terpisah untuk sumber: keep-alive, karena sebagian besar sumber
+            # berada di host yang sama (raw.githubusercontent.com)
+            connector = aiohttp.TCPConnector(
+                resolver=self.make_resolver(),
+                limit=64,
+                limit_per_host=32,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                use_dns_cache=True,
+                ssl=False,
+                family=socket.AF_INET
+            )
+            self.fetch_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=10, connect=2),
+                headers={
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0.4472.124',
+                    'Accept': '*/*'
+                }
+            )
+
+    async def _iter_matches(self, response):
+        # Scan per chunk selagi body masih mengalir. Token ip:port terakhir di tiap chunk
+        # bisa berlanjut di chunk berikutnya, jadi scan berhenti di awal token itu dan
+        # sisanya dibawa ke chunk berikutnya; tidak bergantung pada newline, sehingga
+        # body satu baris (dipisah spasi/koma, HTML) juga di-scan sambil mengalir.
+        # Yield satu iterator match per chunk, bukan per match, untuk menekan overhead
+        tail = bytearray()
+        remaining = MAX_SOURCE_BYTES
+        async for chunk in response.content.iter_chunked(65536):
+            truncated = len(chunk) > remaining
+            if truncated:
+                chunk = chunk[:remaining]
+            remaining -= len(chunk)
+            head = chunk.rstrip(self._TOKEN_BYTES)
+            if head:
+                yield self._PROXY_RE.finditer(tail + head)
+                tail = bytearray(chunk[len(head):])
+            else:
+                tail += chunk
+            if truncated:
+                # Token terakhir mungkin terpotong di batas cap; dibuang agar port
+                # tidak terbaca sebagian
+                logger.warning(f"Source {response.url} exceeds {MAX_SOURCE_BYTES} bytes, truncating")
+                return
+        yield self._PROXY_RE.finditer(tail)
 
-    async def fetch_proxies(self, url: str, protocol: str) -> Set[Proxy]:
-        cache_key = f"proxies_{url}_{protocol}"
+    async def fetch_proxies(self, url: str, protocol: str) -> List[Tuple[str, int, str]]:
+        # v2: nilai berupa list tuple (ip, port, protocol), bukan Set[Proxy] lama
+        cache_key = f"proxies_v2_{url}_{protocol}"
         try:
             cached_proxies = self.cache.get(cache_key)
             if cached_proxies:
@@ -148,144 +290,190 @@ class ProxyScraper:
         except:
             pass
 
-        proxies = set()
+        proxies = []
         try:
-            async with self.session.get(url, timeout=3) as response:
-                if response.status == 200:
-                    content = await response.text()
-                    for line in content.splitlines():  # Fixed: Changed from f to content
-                        if ':' in line:
-                            try:
-                                ip, port = line.strip().split(':')
-                                port = int(port)
-                                if self.is_valid_ip(ip) and self.is_valid_port(port):
-                                    proxy_str = f"{ip}:{port}"
-                                    if proxy_str not in self.blacklist:
-                                        proxy = Proxy(ip, port, protocol)
-                                        if proxy not in self.seen_proxies:
-                                            self.seen_proxies.add(proxy)
-                                            proxies.add(proxy)
-                            except:
+            async with self.fetch_semaphore, self.fetch_session.get(url, timeout=FETCH_TIMEOUT) as response:
+                if response.ok:
+                    async for matches in self._iter_matches(response):
+                        for match in matches:
+                            ip = match.group(1).decode()
+                            port = int(match.group(2))
+                            if not 0 < port < 65536:
                                 continue
+                            key = (ip, port)
+                            if key in self.seen_proxies or f"{ip}:{port}" in self.blacklist:
+                                continue
+                            self.seen_proxies.add(key)
+                            proxies.append((ip, port, protocol))
             if proxies:
-                self.cache.set(cache_key, proxies)
+                self.cache.set(cache_key, proxies, expire=1800)
             logger.info(f"Fetched {len(proxies)} proxies from {url}")
             return proxies
         except Exception as e:
             logger.error(f"Error fetching {url}: {e}")
-            return set()
+            return []
+
+    async def _probe(self, session: aiohttp.ClientSession, url: str = CHECK_URL, **kwargs) -> Optional[float]:
+        # Endpoint 204: tanpa body, tanpa parsing JSON, satu RTT
+        start_time = time.monotonic_ns()
+        async with session.head(
+            url,
+            timeout=aiohttp.ClientTimeout(total=5.0),
+            allow_redirects=False,
+            **kwargs
+        ) as response:
+            if response.status == 204:
+                return (time.monotonic_ns() - start_time) / 1_000_000
+        return None
 
     async def check_proxy(self, proxy: Proxy) -> bool:
-        test_urls = [
-            "http://ip-api.com/json/",
-            "http://httpbin.org/ip",
-            "http://ipinfo.io/json"
-        ]
-        timeout = aiohttp.ClientTimeout(total=5.0)
-        for url in test_urls:
-            try:
-                start_time = time.time()
-                async with self.session.get(
-                    url,
-                    proxy=f"{proxy.protocol}://{proxy.ip}:{proxy.port}",
-                    timeout=timeout,
-                    allow_redirects=False,
-                    ssl=False
-                ) as response:
-                    if response.status in [200, 201, 202]:
-                        latency = (time.time() - start_time) * 1000
-                        if latency < self.latency_limit:
-                            proxy.latency = latency
-                            return True
-            except:
-                continue
+        try:
+            if proxy.protocol == 'http':
+                latency = await self._probe(self.session, proxy=proxy.url, ssl=False)
+            else:
+                # proxy= di aiohttp hanya untuk HTTP; SOCKS butuh connector per proxy.
+                # Sesi pemilik connector menutupnya saat keluar dari blok
+                connector = ProxyConnector.from_url(proxy.url)
+                async with aiohttp.ClientSession(connector=connector) as session:
+                    latency = await self._probe(
+                        session, self.socks_check_url, headers=self.socks_check_headers
+                    )
+            if latency is not None and latency < self.latency_limit:
+                proxy.latency = latency
+                return True
+        except (asyncio.TimeoutError, OSError):
+            # Diteruskan ke verify_proxies sebagai sinyal untuk AdaptiveLimiter
+            raise
+        except Exception:
+            pass
         return False
 
-    async def verify_proxies(self, proxies: List[Proxy]) -> Tuple[List[Proxy], List[str]]:
+    async def verify_proxies(self, queue: asyncio.Queue, workers: int) -> Tuple[List[Proxy], List[str]]:
         verified = []
         invalid = []
-        total = len(proxies)
-        processed = 0
-        alive = 0
-        dead = 0
-
-        for i in range(0, total, self.batch_size):
-            batch = proxies[i:i + self.batch_size]
-            tasks = [self.check_proxy(proxy) for proxy in batch]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-
-            for proxy, result in zip(batch, results):
-                proxy_str = proxy.format()
-                if isinstance(result, bool) and result:
+
+        # Pipeline kontinu: slot langsung dipakai proxy berikutnya begitu satu selesai
+        limiter = AdaptiveLimiter(
+            initial=self.max_connections // 2,
+            minimum=self.min_concurrency,
+            maximum=self.max_connections
+        )
+
+        async def guarded(candidate: Tuple[str, int, str]) -> Optional[Proxy]:
+            async with limiter:
+                # Proxy baru dibuat di dalam slot: paling banyak `limit` objek hidup,
+                # ditambah yang lolos verifikasi
+                proxy = Proxy(*candidate)
+                result, congested = False, False
+                try:
+                    result = await self.check_proxy(proxy)
+                except asyncio.TimeoutError:
+                    congested = True
+                except OSError as e:
+                    congested = e.errno in (errno.EMFILE, errno.ENFILE)
+                except Exception:
+                    pass
+                limiter.record(congested)
+                return proxy if result else None
+
+        async def worker():
+            while True:
+                candidate = await queue.get()
+                if candidate is None:
+                    return
+                proxy = await guarded(candidate)
+                if proxy is not None:
                     verified.append(proxy)
-                    alive += 1
                 else:
-                    invalid.append(proxy_str)
-                    dead += 1
-                processed += 1
+                    invalid.append(f"{candidate[0]}:{candidate[1]}")
+                processed = len(verified) + len(invalid)
                 if processed % 100 == 0:
-                    logger.info(f"Stats: Total={total}, Alive={alive}, Dead={dead}, Progress={int(processed/total*100)}%")
-            await asyncio.sleep(0.2)
+                    logger.info(f"Stats: Processed={processed}, Alive={len(verified)}, Dead={len(invalid)}, Queued={queue.qsize()}")
 
-        logger.info(f"Verification complete: Total={total}, Alive={alive}, Dead={dead}")
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        logger.info(f"Verification complete: Total={len(verified) + len(invalid)}, Alive={len(verified)}, Dead={len(invalid)}")
         return verified, invalid
 
-    async def hyper_scrape(self, protocols: List[str]) -> List[Proxy]:
-        tasks = []
-        for protocol in protocols:
-            for url in self.sources.get(protocol, []):
-                tasks.append(self.fetch_proxies(url, protocol))
-        results = await asyncio.gather(*tasks)
-        all_proxies = set()
-        for proxy_set in results:
-            all_proxies.update(proxy_set)
-        logger.info(f"Scraped {len(all_proxies)} unique proxies")
-        return list(all_proxies)
+    async def hyper_scrape(self, protocols: List[str], queue: asyncio.Queue):
+        # Dedup global atas tuple; kandidat langsung masuk antrean begitu
+        # sumbernya selesai, tanpa menunggu sumber lain
+        queued: Set[Tuple[str, int]] = set()
+
+        async def produce(url: str, protocol: str):
+            for ip, port, proto in await self.fetch_proxies(url, protocol):
+                if (ip, port) not in queued:
+                    queued.add((ip, port))
+                    await queue.put((ip, port, proto))
+
+        await asyncio.gather(*(
+            produce(url, protocol)
+            for protocol in protocols
+            for url in self.sources.get(protocol, [])
+        ))
+        logger.info(f"Scraped {len(queued)} unique proxies")
+
+    async def scrape_and_verify(self, protocols: List[str]) -> Tuple[List[Proxy], List[str]]:
+        # Scrape dan verifikasi berjalan bersamaan lewat antrean terbatas
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        workers = self.max_connections
+        verifier = asyncio.ensure_future(self.verify_proxies(queue, workers))
+        try:
+            await self.hyper_scrape(protocols, queue)
+        finally:
+            for _ in range(workers):
+                await queue.put(None)
+        return await verifier
 
     async def close_session(self):
         if self.session and not self.session.closed:
             await self.session.close()
             self.session = None
+        if self.fetch_session and not self.fetch_session.closed:
+            await self.fetch_session.close()
+            self.fetch_session = None
 
-    def save_proxies(self, proxies: List[Proxy], invalid_proxies: List[str]):
+    async def save_proxies(self, proxies: List[Proxy], invalid_proxies: List[str]):
         all_proxies = []
-        http_proxies = []
-        socks4_proxies = []
-        socks5_proxies = []
+        buckets = {'http': [], 'socks4': [], 'socks5': []}
 
         for proxy in sorted(proxies, key=lambda x: x.latency):
             proxy_str = proxy.format()
             all_proxies.append(proxy_str)
-            if proxy.protocol == 'http':
-                http_proxies.append(proxy_str)
-            elif proxy.protocol == 'socks4':
-                socks4_proxies.append(proxy_str)
-            elif proxy.protocol == 'socks5':
-                socks5_proxies.append(proxy_str)
-
-        for filename, data in [
-            ('all-proxies.txt', all_proxies),
-            ('http-proxies.txt', http_proxies),
-            ('socks4-proxies.txt', socks4_proxies),
-            ('socks5-proxies.txt', socks5_proxies),
-            ('blacklist.txt', invalid_proxies)
-        ]:
-            with open(filename, 'w') as f:
-                f.write('\n'.join(data) + '\n')
-            logger.info(f"Saved {len(data)} entries to {filename}")
+            bucket = buckets.get(proxy.protocol)
+            if bucket is not None:
+                bucket.append(proxy_str)
+
+        # Tiap file ditulis paralel di thread agar event loop tidak terblokir
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(None, self._write_file, filename, data)
+            for filename, data in [
+                ('all-proxies.txt', all_proxies),
+                ('http-proxies.txt', buckets['http']),
+                ('socks4-proxies.txt', buckets['socks4']),
+                ('socks5-proxies.txt', buckets['socks5']),
+                ('blacklist.txt', invalid_proxies)
+            ]
+        ))
+
+    @staticmethod
+    def _write_file(filename: str, data: List[str]):
+        # Satu write() biner per file, tanpa lapisan TextIOWrapper
+        with open(filename, 'wb') as f:
+            f.write(('\n'.join(data) + '\n').encode())
+        logger.info(f"Saved {len(data)} entries to {filename}")
 
 async def main():
     async with ProxyScraper() as scraper:
         try:
             logger.info("Starting OtoProxy")
-            proxies = await scraper.hyper_scrape(['http', 'socks4', 'socks5'])
-            logger.info("Verifying proxies")
-            verified_proxies, invalid_proxies = await scraper.verify_proxies(proxies)
+            logger.info("Scraping and verifying proxies")
+            verified_proxies, invalid_proxies = await scraper.scrape_and_verify(['http', 'socks4', 'socks5'])
             logger.info("Saving results")
-            scraper.save_proxies(verified_proxies, invalid_proxies)
+            await scraper.save_proxies(verified_proxies, invalid_proxies)
             logger.info("OtoProxy completed")
         except Exception as e:
             logger.error(f"Error: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())